@@ -1,85 +1,255 @@
 import os
-import subprocess
-import nest_asyncio
+import time
+import asyncio
 import uvicorn
 import re
 import base64
+from functools import lru_cache, wraps
 from fastapi import FastAPI, HTTPException
-from fastapi.responses import HTMLResponse
+from fastapi.responses import FileResponse, HTMLResponse, ORJSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from typing import List, Optional, Dict, Any
 
 # --- CONFIGURACIÓN DE ENERGÍA (Ruta ADB) ---
 # Buscamos el equilibrio: primero la intención explícita (Variable de Entorno),
 # luego la ruta natural del entorno local (Windows Default), y finalmente la omnipresencia del sistema (PATH).
 
-env_adb = os.environ.get("ADB_PATH")
-local_adb = os.path.join(os.path.expanduser("~"), r"AppData\Local\Android\Sdk\platform-tools\adb.exe")
+@lru_cache(maxsize=None)
+def _resolve_adb_path() -> str:
+    # Resuelto una sola vez por proceso; _resolve_adb_path.cache_clear() vuelve a sintonizar (p. ej. tras cambiar ADB_PATH)
+    env_adb = os.environ.get("ADB_PATH")
+    local_adb = os.path.join(os.path.expanduser("~"), r"AppData\Local\Android\Sdk\platform-tools\adb.exe")
 
-if env_adb:
-    ADB_PATH = env_adb
-elif os.path.exists(local_adb):
-    ADB_PATH = local_adb
-else:
-    ADB_PATH = "adb"
+    if env_adb:
+        adb_path = env_adb
+    elif os.path.exists(local_adb):
+        adb_path = local_adb
+    else:
+        adb_path = "adb"
 
-# Validación final de existencia para asegurar que el flujo no se bloquee
-if not os.path.exists(ADB_PATH) and ADB_PATH != "adb":
-    print(f"Nota: No se encontró ADB en la ruta detectada ({ADB_PATH}). Usando 'adb' del sistema.")
-    ADB_PATH = "adb"
+    # Validación final de existencia para asegurar que el flujo no se bloquee
+    if not os.path.exists(adb_path) and adb_path != "adb":
+        print(f"Nota: No se encontró ADB en la ruta detectada ({adb_path}). Usando 'adb' del sistema.")
+        adb_path = "adb"
+    return adb_path
 
-nest_asyncio.apply()
+ADB_PATH = _resolve_adb_path()
 
-app = FastAPI(title="Holistic Mobile Auditor", description="API consciente para auditoría ADB")
+# ORJSONResponse como clase por defecto: requiere FastAPI < 0.131 (versión fijada en el README)
+app = FastAPI(title="Holistic Mobile Auditor", description="API consciente para auditoría ADB", default_response_class=ORJSONResponse)
+
+# Orígenes permitidos (ALLOWED_ORIGINS separados por comas). El Canvas se sirve desde el mismo origen;
+# con "*" no se permiten credenciales (los navegadores las rechazan y Starlette tendría que reflejar el Origin)
+ALLOWED_ORIGINS = [o.strip() for o in os.environ.get("ALLOWED_ORIGINS", "http://localhost:8000,http://127.0.0.1:8000").split(",") if o.strip()]
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
+    allow_origins=ALLOWED_ORIGINS,
+    allow_credentials=ALLOWED_ORIGINS != ["*"],
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
+# Los volcados dumpsys y las listas de permisos se comprimen muy bien; coste de CPU mínimo en LAN
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=4)
+
+# --- PATRONES (compilados una sola vez) ---
+
+_RE_VERSION_NAME = re.compile(r"versionName=(\S+)")
+_RE_VERSION_CODE = re.compile(r"versionCode=(\d+)")
+_RE_UID = re.compile(r"userId=(\d+)")
+_RE_APPID = re.compile(r"appId=(\d+)")
+_RE_DATA_DIR = re.compile(r"dataDir=(\S+)")
+_RE_PERM_BLOCK = re.compile(r"requested permissions:(.*?)(install permissions:|User \d|runtime permissions:)", re.DOTALL)
+_RE_PERM_TOKEN = re.compile(r"(android\.permission\.[\w_]+|com\.[\w\.]+\.permission\.[\w_]+)")
+_RE_PERM_NAME = re.compile(r"([\w\.]+\.permission\.[\w\_]+)")
+_RE_INSTALL_BLOCK = re.compile(r"install permissions:(.*?)(User \d|runtime permissions:)", re.DOTALL)
+# Ventana de metadatos: versionName/versionCode/userId/dataDir viven al inicio del bloque "Packages:"
+_HEAD_WINDOW = 8192
+
+_RE_GRANTED = re.compile(r"([\w\.]+\.permission\.[\w\_]+):\s*granted=true")
+_RE_SCHEME = re.compile(r'Scheme: "([^"]+)"')
+_RE_PROVIDER = re.compile(r"Provider\{[a-f0-9]+\s+(\S+)\}")
+_RE_ACTION = re.compile(r'Action: "([^"]+)"')
+_RE_CATEGORY = re.compile(r'Category: "([^"]+)"')
+# Línea de `ls -l`: las columnas intermedias (enlaces, dueño, grupo, contexto) varían, el tamaño precede a la fecha
+_RE_LS_LINE = re.compile(r"^(?P<perms>\S+)\s+(?:\S+\s+)*?(?P<size>\S+)\s+(?P<date>\d{4}-\d{2}-\d{2}\s+\d{2}:\d{2})\s+(?P<name>.+)$")
+_RE_PKG_HEADER = re.compile(r"^Package \[(.*?)\]")
+_RE_DOMAIN_VER = re.compile(r"Domain verification state:(.*?)(User 0:|$)", re.DOTALL)
+_RE_DOMAIN_LINE = re.compile(r"\s+([\w\.-]+):\s+(\d+)")
+_RE_DOMAIN_TOKEN = re.compile(r"[\w\.-]+")
+
+@lru_cache(maxsize=8)
+def _printable_bytes_re(n: int):
+    return re.compile(rb"[ -~]{%d,}" % n)
+
+# Lecturas grandes en Base64 se transmiten por fragmentos (múltiplos de 3 bytes -> Base64 sin relleno intermedio)
+_STREAM_THRESHOLD = 1024 * 1024
+_STREAM_CHUNK = 64 * 1024
+
+# Memoria breve: las enumeraciones ADB solo cambian al instalar/desinstalar, no en cada refresco de la UI
+_CACHE_TTL = 10
+_CACHE_MAXSIZE = 128
+_CACHE: Dict[tuple, tuple] = {}
+_INFLIGHT: Dict[tuple, asyncio.Future] = {}
+
 # --- UTILIDADES ---
 
-def run_adb_command(command: List[str], binary_mode: bool = False, check_exit_code: bool = True):
+async def run_adb_async(command: List[str], binary_mode: bool = False, check_exit_code: bool = True):
+    # El flujo ADB no bloquea el bucle de eventos: cada llamada es un subproceso asíncrono
     try:
-        full_command = [ADB_PATH] + command
-        result = subprocess.run(
-            full_command,
-            capture_output=True,
-            text=not binary_mode, 
-            check=check_exit_code,
-            encoding='utf-8' if not binary_mode else None, 
-            errors='replace' if not binary_mode else None
+        proc = await asyncio.create_subprocess_exec(
+            _resolve_adb_path(), *command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
         )
-        if binary_mode: return result.stdout 
-        else: return result.stdout.strip()
-    except subprocess.CalledProcessError as e:
-        error_msg = e.stderr if e.stderr else str(e)
-        # Algunos comandos como 'ls' pueden devolver exit code != 0 pero dar info útil
-        if not check_exit_code:
-            return e.stdout if e.stdout else ""
+        out, err = await proc.communicate()
+    except FileNotFoundError:
+        raise HTTPException(status_code=500, detail=f"ADB no encontrado en: {_resolve_adb_path()}. Verifica la ruta.")
+    # Algunos comandos como 'ls' pueden devolver exit code != 0 pero dar info útil
+    if check_exit_code and proc.returncode != 0:
+        error_msg = err.decode('utf-8', errors='replace') if err else f"exit code {proc.returncode}"
         raise HTTPException(status_code=500, detail=f"Error en el flujo ADB: {error_msg}")
+    if binary_mode: return out
+    else: return out.decode('utf-8', errors='replace').strip()
+
+def async_ttl_cache(ttl: float = _CACHE_TTL):
+    # Cachea el resultado de una corrutina por (nombre, argumentos) durante `ttl` segundos.
+    # Las excepciones no se cachean; el primer argumento posicional suele ser el device_id.
+    # Las llamadas concurrentes con la misma clave comparten una única ejecución en vuelo.
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args):
+            key = (func.__name__,) + args
+            entry = _CACHE.get(key)
+            if entry and entry[0] > time.monotonic(): return entry[1]
+            pending = _INFLIGHT.get(key)
+            if pending: return await asyncio.shield(pending)
+            task = asyncio.ensure_future(func(*args))
+            _INFLIGHT[key] = task
+            def settle(t):
+                _INFLIGHT.pop(key, None)
+                if not t.cancelled(): t.exception()  # la marca como recuperada aunque nadie la espere ya
+            task.add_done_callback(settle)
+            value = await asyncio.shield(task)
+            now = time.monotonic()
+            if len(_CACHE) >= _CACHE_MAXSIZE:
+                for k in [k for k, (exp, _) in _CACHE.items() if exp <= now]: del _CACHE[k]
+                while len(_CACHE) >= _CACHE_MAXSIZE: del _CACHE[next(iter(_CACHE))]
+            _CACHE[key] = (now + ttl, value)
+            return value
+        return wrapper
+    return decorator
+
+def clear_device_cache(device_id: str) -> int:
+    # La lista de dispositivos no tiene device_id: se libera siempre junto al resto
+    keys = [k for k in _CACHE if len(k) == 1 or k[1] == device_id]
+    for k in keys: del _CACHE[k]
+    return len(keys)
+
+async def stream_adb_base64(command: List[str], expected_size: int):
+    # El proceso se lanza y el primer fragmento se lee antes de devolver la respuesta: ADB ausente,
+    # dispositivo desconectado o lectura vacía siguen siendo HTTP 500. Un fallo posterior (ya con
+    # cabeceras enviadas) aborta la transmisión, y el cliente ve un cuerpo incompleto, no un fin limpio.
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            _resolve_adb_path(), *command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
     except FileNotFoundError:
-        raise HTTPException(status_code=500, detail=f"ADB no encontrado en: {ADB_PATH}. Verifica la ruta.")
+        raise HTTPException(status_code=500, detail=f"ADB no encontrado en: {_resolve_adb_path()}. Verifica la ruta.")
+
+    async def stop():
+        if proc.returncode is None:
+            try: proc.kill()
+            except ProcessLookupError: pass
+        await proc.wait()
+
+    first = await proc.stdout.read(_STREAM_CHUNK)
+    if not first:
+        err = await proc.stderr.read()
+        await stop()
+        error_msg = err.decode('utf-8', errors='replace').strip() if err else f"exit code {proc.returncode}"
+        raise HTTPException(status_code=500, detail=f"Error en el flujo ADB: {error_msg}")
+
+    async def flow():
+        pending = first
+        sent = 0
+        try:
+            while True:
+                cut = len(pending) - len(pending) % 3
+                if cut:
+                    yield base64.b64encode(pending[:cut])
+                    sent += cut
+                    pending = pending[cut:]
+                chunk = await proc.stdout.read(_STREAM_CHUNK)
+                if not chunk: break
+                pending += chunk
+            if pending:
+                yield base64.b64encode(pending)
+                sent += len(pending)
+            await proc.wait()
+            if proc.returncode != 0 or sent != expected_size:
+                raise RuntimeError(f"Flujo ADB incompleto: {sent}/{expected_size} bytes (exit code {proc.returncode})")
+        finally:
+            await stop()
+
+    return flow()
+
+async def grep_adb_lines(command: List[str], pattern) -> List[str]:
+    # Filtrado local línea a línea: sin `| grep` en el shell del dispositivo (ni inyección, ni búfer completo)
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            _resolve_adb_path(), *command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+            limit=1024 * 1024
+        )
+    except FileNotFoundError:
+        raise HTTPException(status_code=500, detail=f"ADB no encontrado en: {_resolve_adb_path()}. Verifica la ruta.")
+    matches = []
+    try:
+        async for raw_line in proc.stdout:
+            line = raw_line.decode('utf-8', errors='replace').rstrip('\r\n')
+            if pattern.search(line): matches.append(line)
+    finally:
+        if proc.returncode is None:
+            try: proc.kill()
+            except ProcessLookupError: pass
+        await proc.wait()
+    return matches
+
+def shell_quote(value: str) -> str:
+    # adb shell une los argumentos en una sola línea para el sh remoto: comillas simples seguras
+    return "'" + value.replace("'", "'\\''") + "'"
+
+async def probe_readable_size(device_id: str, path: str) -> Optional[int]:
+    # exec-out no devuelve el código de salida remoto y mezcla stderr con stdout: un `cat` fallido
+    # llegaría como contenido. Se comprueba antes por `shell` (con centinela, válido sin shell v2).
+    q = shell_quote(path)
+    probe = f"if [ -f {q} ] && [ -r {q} ]; then stat -c %s {q}; else echo NOREAD; fi"
+    output = await run_adb_async(["-s", device_id, "shell", probe], check_exit_code=False)
+    if output == "NOREAD":
+        raise HTTPException(status_code=500, detail=f"Archivo no legible (permisos o no es un archivo regular): {path}")
+    return int(output) if output.isdigit() else None
 
 def extract_strings_from_bytes(data: bytes, min_length: int = 4) -> List[str]:
+    # El patrón opera sobre los bytes crudos: sin copia decodificada intermedia
     try:
-        text = data.decode('utf-8', errors='ignore')
-        pattern = r"[ -~]{" + str(min_length) + r",}"
-        return re.findall(pattern, text)
+        return [m.decode('ascii') for m in _printable_bytes_re(min_length).findall(data)]
     except Exception:
         return []
 
-def get_app_links_state(device_id: str, package_name: str) -> Dict[str, Any]:
+async def get_app_links_state(device_id: str, package_name: str) -> Dict[str, Any]:
     """
     Consulta el estado de verificación de App Links (Android 12+).
     Identifica bloqueos en la confianza entre Dominio y App.
     """
     try:
         cmd = ["-s", device_id, "shell", "pm", "get-app-links", "--user", "0", package_name]
-        output = run_adb_command(cmd, check_exit_code=False)
+        output = await run_adb_async(cmd, check_exit_code=False)
         
         domains = []
         
@@ -87,11 +257,20 @@ def get_app_links_state(device_id: str, package_name: str) -> Dict[str, Any]:
         # Buscamos líneas como: "  example.com: 1024" dentro de "Domain verification state:"
         
         # Extraer sección de estado de verificación
-        verification_section = re.search(r"Domain verification state:(.*?)(User 0:|$)", output, re.DOTALL)
+        verification_section = _RE_DOMAIN_VER.search(output)
         if verification_section:
             block = verification_section.group(1)
             # Encontrar dominios y sus códigos de estado
-            matches = re.findall(r"\s+([\w\.-]+):\s+(\d+)", block)
+            matches = _RE_DOMAIN_LINE.findall(block)
+
+            # Dominios deshabilitados por el usuario: se reúnen una sola vez antes del bucle
+            disabled_set = set()
+            idx = output.find("Disabled:")
+            if idx >= 0:
+                end = output.find("\n\n", idx)
+                disabled_block = output[idx + len("Disabled:"): end if end != -1 else len(output)]
+                disabled_set = set(_RE_DOMAIN_TOKEN.findall(disabled_block))
+
             for domain, state_code in matches:
                 state_desc = "Unknown"
                 status = "warning" # Default state
@@ -119,7 +298,7 @@ def get_app_links_state(device_id: str, package_name: str) -> Dict[str, Any]:
 
                 # Verificar si está explícitamente deshabilitado por el usuario
                 is_disabled = False
-                if f"Disabled:\n" in output and domain in output.split("Disabled:")[1]:
+                if domain in disabled_set:
                      is_disabled = True
                      status = "danger"
                      state_desc += " [USER DISABLED]"
@@ -136,6 +315,10 @@ def get_app_links_state(device_id: str, package_name: str) -> Dict[str, Any]:
         print(f"Error obteniendo app links: {e}")
         return {"domains": [], "raw": str(e)}
 
+def _search_head(pattern, head: str, raw_data: str):
+    # Busca primero en la ventana corta; solo recorre el volcado completo si el campo no aparece allí
+    return pattern.search(head) or (pattern.search(raw_data) if head is not raw_data else None)
+
 def analyze_security_posture(raw_data: str) -> Dict[str, Any]:
     analysis = {
         "version_name": "Unknown", "version_code": "Unknown", "user_id": "Unknown",
@@ -146,50 +329,49 @@ def analyze_security_posture(raw_data: str) -> Dict[str, Any]:
         "is_debuggable": False
     }
     try:
-        v_name = re.search(r"versionName=([^\s]+)", raw_data)
+        # Las tablas de resolución de intents preceden a "Packages:" y pueden ocupar cientos de KB
+        pkg_idx = raw_data.find("Packages:")
+        head = raw_data[pkg_idx:pkg_idx + _HEAD_WINDOW] if pkg_idx >= 0 else raw_data[:_HEAD_WINDOW]
+
+        v_name = _search_head(_RE_VERSION_NAME, head, raw_data)
         if v_name: analysis["version_name"] = v_name.group(1)
         
-        v_code = re.search(r"versionCode=(\d+)", raw_data)
+        v_code = _search_head(_RE_VERSION_CODE, head, raw_data)
         if v_code: analysis["version_code"] = v_code.group(1)
         
-        uid = re.search(r"userId=(\d+)", raw_data)
+        uid = _search_head(_RE_UID, head, raw_data)
         if uid: analysis["user_id"] = uid.group(1)
         elif "appId=" in raw_data:
-             app_id = re.search(r"appId=(\d+)", raw_data)
+             app_id = _search_head(_RE_APPID, head, raw_data)
              if app_id: analysis["user_id"] = app_id.group(1)
 
-        data_dir = re.search(r"dataDir=([^\s]+)", raw_data)
+        data_dir = _search_head(_RE_DATA_DIR, head, raw_data)
         if data_dir: analysis["data_dir"] = data_dir.group(1)
 
         if "DEBUGGABLE" in raw_data or "debuggable=true" in raw_data: analysis["is_debuggable"] = True
 
-        perm_block_match = re.search(r"requested permissions:(.*?)(install permissions:|User \d|runtime permissions:)", raw_data, re.DOTALL)
+        perm_block_match = _RE_PERM_BLOCK.search(raw_data)
         if perm_block_match:
             perm_block = perm_block_match.group(1)
-            perms = re.findall(r"(android\.permission\.[\w_]+|com\.[\w\.]+\.permission\.[\w_]+)", perm_block)
-            analysis["permissions"] = sorted(list(set(perms))) 
+            analysis["permissions"] = sorted(set(_RE_PERM_TOKEN.findall(perm_block)))
 
-        granted_matches = re.findall(r"([\w\.]+\.permission\.[\w\_]+):\s*granted=true", raw_data)
-        install_perm_block = re.search(r"install permissions:(.*?)(User \d|runtime permissions:)", raw_data, re.DOTALL)
+        granted = set(_RE_GRANTED.findall(raw_data))
+        install_perm_block = _RE_INSTALL_BLOCK.search(raw_data)
         if install_perm_block:
-            install_perms = re.findall(r"([\w\.]+\.permission\.[\w\_]+)", install_perm_block.group(1))
-            granted_matches.extend(install_perms)
+            granted.update(_RE_PERM_NAME.findall(install_perm_block.group(1)))
             
-        analysis["granted_permissions"] = sorted(list(set(granted_matches)))
+        analysis["granted_permissions"] = sorted(granted)
 
-        scheme_matches = re.findall(r"Scheme: \"([^\"]+)\"", raw_data)
-        filtered_schemes = [s for s in set(scheme_matches) if s not in ["android.intent.category.DEFAULT", "android.intent.category.BROWSABLE"]]
-        analysis["schemes"] = sorted(filtered_schemes)
+        # Patrones separados con prefijo literal: sre salta directamente al siguiente candidato
+        schemes = set(_RE_SCHEME.findall(raw_data))
+        schemes.difference_update(("android.intent.category.DEFAULT", "android.intent.category.BROWSABLE"))
+        analysis["schemes"] = sorted(schemes)
 
-        provider_matches = re.findall(r"Provider\{[a-f0-9]+\s+([^\s]+)\}", raw_data)
-        analysis["providers"] = sorted(list(set(provider_matches)))
+        analysis["providers"] = sorted(set(_RE_PROVIDER.findall(raw_data)))
 
         # --- PARSING DE INTENCIONES (Acciones y Categorías) ---
-        actions_found = re.findall(r'Action: "([^"]+)"', raw_data)
-        categories_found = re.findall(r'Category: "([^"]+)"', raw_data)
-        
-        analysis["intent_actions"] = sorted(list(set(actions_found)))
-        analysis["intent_categories"] = sorted(list(set(categories_found)))
+        analysis["intent_actions"] = sorted(set(_RE_ACTION.findall(raw_data)))
+        analysis["intent_categories"] = sorted(set(_RE_CATEGORY.findall(raw_data)))
 
     except Exception as e:
         print(f"Error parseando seguridad: {e}")
@@ -197,44 +379,86 @@ def analyze_security_posture(raw_data: str) -> Dict[str, Any]:
 
 def parse_ls_output(output: str) -> List[Dict[str, Any]]:
     files = []
-    lines = output.split('\n')
-    for line in lines:
-        line = line.strip()
+    for line in output.splitlines():
         if not line or line.startswith("total "): continue
-        try:
-            parts = line.split()
-            if len(parts) < 7: continue
-            perms = parts[0]
-            is_dir = perms.startswith('d')
-            is_link = perms.startswith('l')
-            date_idx = -1
-            for i, p in enumerate(parts):
-                if re.match(r"\d{4}-\d{2}-\d{2}", p):
-                    date_idx = i
-                    break
-            if date_idx != -1:
-                size = parts[date_idx-1]
-                date_str = f"{parts[date_idx]} {parts[date_idx+1]}"
-                name_part = " ".join(parts[date_idx+2:])
-                files.append({
-                    "name": name_part,
-                    "type": "dir" if is_dir else ("link" if is_link else "file"),
-                    "size": size,
-                    "date": date_str,
-                    "perms": perms,
-                    "raw": line
-                })
-        except Exception as e:
-            # print(f"Error parsing line '{line}': {e}") # Silent error for cleaner logs
-            pass
+        m = _RE_LS_LINE.match(line)
+        if not m: continue
+        perms = m['perms']
+        kind = perms[0]
+        files.append({
+            "name": m['name'].rstrip(),
+            "type": "dir" if kind == 'd' else ("link" if kind == 'l' else "file"),
+            "size": m['size'],
+            "date": " ".join(m['date'].split()),
+            "perms": perms,
+            "raw": line
+        })
     return files
 
+# --- FLUJOS EN CACHÉ ---
+
+@async_ttl_cache(ttl=5)
+async def _fetch_devices_raw() -> str:
+    return await run_adb_async(["devices"])
+
+@async_ttl_cache()
+async def _fetch_package_names(device_id: str) -> List[str]:
+    cmd_simple = ["-s", device_id, "shell", "pm", "list", "packages"]
+    output_simple = await run_adb_async(cmd_simple)
+    return [line.replace("package:", "").strip() for line in output_simple.split('\n') if line.strip()]
+
+@async_ttl_cache()
+async def _fetch_package_dates(device_id: str) -> Dict[str, Dict[str, Any]]:
+    # Se cachea ya parseado: las recargas repetidas no vuelven a recorrer el volcado global
+    # La lista simple y el volcado son independientes: latencia max(a, b) en lugar de a + b
+    cmd_dump = ["-s", device_id, "shell", "dumpsys", "package"]
+    package_names, dump_output = await asyncio.gather(
+        _fetch_package_names(device_id),
+        run_adb_async(cmd_dump)
+    )
+    # Una sola pasada: los bloques de paquetes no solicitados se atraviesan sin análisis
+    wanted = set(package_names)
+    pkg_data = {}
+    current_pkg = None
+    for line in dump_output.splitlines():
+        line = line.strip()
+        if line.startswith("Package ["):
+            pkg_match = _RE_PKG_HEADER.match(line)
+            current_pkg = pkg_match.group(1) if pkg_match and pkg_match.group(1) in wanted else None
+            if current_pkg and current_pkg not in pkg_data: pkg_data[current_pkg] = {"name": current_pkg, "installTime": None, "timeStamp": None, "updateTime": None}
+            continue
+        if current_pkg is None: continue
+        if line.startswith("firstInstallTime="): pkg_data[current_pkg]["installTime"] = line.partition("=")[2].strip()
+        elif line.startswith("timeStamp="): pkg_data[current_pkg]["timeStamp"] = line.partition("=")[2].strip()
+        elif line.startswith("lastUpdateTime="): pkg_data[current_pkg]["updateTime"] = line.partition("=")[2].strip()
+    return pkg_data
+
+@async_ttl_cache(ttl=30)
+async def _fetch_magic(device_id: str, path: str) -> Dict[str, str]:
+    # Mapa nombre -> tipo (magic numbers) del directorio; paginar adelante y atrás no repite la sonda
+    safe_path = path.replace('"', '\\"')
+    cmd_magic = ["-s", device_id, "shell", f"cd \"{safe_path}\" && file *"]
+    magic_output = await run_adb_async(cmd_magic, check_exit_code=False)
+    
+    magic_map = {}
+    for line in magic_output.split('\n'):
+        line = line.strip()
+        if ": " in line:
+            parts = line.split(": ", 1)
+            if len(parts) == 2:
+                fname = parts[0].strip()
+                if fname.startswith("./"): fname = fname[2:]
+                fname = fname.strip("'").strip('"')
+                desc = parts[1].strip()
+                magic_map[fname] = desc
+    return magic_map
+
 # --- ENDPOINTS ---
 
 @app.get("/devices")
-def list_devices():
+async def list_devices():
     try:
-        output = run_adb_command(["devices"])
+        output = await _fetch_devices_raw()
         lines = output.split('\n')[1:] 
         devices = []
         for line in lines:
@@ -247,27 +471,17 @@ def list_devices():
         return {"devices": []}
 
 @app.get("/packages/{device_id}")
-def list_packages_detailed(device_id: str):
+async def list_packages_detailed(device_id: str):
     try:
-        cmd_simple = ["-s", device_id, "shell", "pm", "list", "packages"]
-        output_simple = run_adb_command(cmd_simple)
-        package_names = [line.replace("package:", "").strip() for line in output_simple.split('\n') if line.strip()]
+        # Ambos flujos en paralelo; la lista simple se comparte en vuelo con la que usa el volcado
+        package_names, pkg_data = await asyncio.gather(
+            _fetch_package_names(device_id),
+            _fetch_package_dates(device_id),
+            return_exceptions=True
+        )
+        if isinstance(package_names, BaseException): raise package_names
         try:
-            cmd_dump = ["-s", device_id, "shell", "dumpsys", "package"]
-            dump_output = run_adb_command(cmd_dump)
-            pkg_data = {}
-            current_pkg = None
-            lines = dump_output.split('\n')
-            for i, line in enumerate(lines):
-                line = line.strip()
-                pkg_match = re.search(r"^Package \[(.*?)\]", line)
-                if pkg_match:
-                    current_pkg = pkg_match.group(1)
-                    if current_pkg not in pkg_data: pkg_data[current_pkg] = {"name": current_pkg, "installTime": None, "timeStamp": None, "updateTime": None}
-                if current_pkg:
-                    if "firstInstallTime=" in line: pkg_data[current_pkg]["installTime"] = line.split("firstInstallTime=")[1].strip()
-                    elif "timeStamp=" in line: pkg_data[current_pkg]["timeStamp"] = line.split("timeStamp=")[1].strip()
-                    elif "lastUpdateTime=" in line: pkg_data[current_pkg]["updateTime"] = line.split("lastUpdateTime=")[1].strip()
+            if isinstance(pkg_data, BaseException): raise pkg_data
             final_list = []
             for name in package_names:
                 raw = pkg_data.get(name, {})
@@ -281,27 +495,38 @@ def list_packages_detailed(device_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/package/{device_id}/{package_name}/details")
-def get_single_package_details(device_id: str, package_name: str):
+async def get_single_package_details(device_id: str, package_name: str, include_raw: bool = False):
     try:
-        # 1. Dumpsys principal
+        # 1. Dumpsys principal y 2. Análisis de App Links, en paralelo
         cmd = ["-s", device_id, "shell", "dumpsys", "package", package_name]
-        raw_output = run_adb_command(cmd)
+        raw_output, app_links_data = await asyncio.gather(
+            run_adb_async(cmd),
+            get_app_links_state(device_id, package_name)
+        )
         analysis = analyze_security_posture(raw_output)
         
-        # 2. Análisis de App Links (Específico de tu solicitud)
-        app_links_data = get_app_links_state(device_id, package_name)
         analysis["app_links"] = app_links_data["domains"]
         analysis["app_links_raw"] = app_links_data["raw"]
 
-        return {"package": package_name, "analysis": analysis, "raw_info": raw_output}
+        result = {"package": package_name, "analysis": analysis}
+        # El volcado crudo puede pesar MB: solo viaja si el cliente lo pide
+        if include_raw: result["raw_info"] = raw_output
+        return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/files/{device_id}")
-def list_files_in_path(device_id: str, path: str):
+async def list_files_in_path(device_id: str, path: str):
     try:
+        # Listado y sonda magic en paralelo; un fallo de la sonda no interrumpe el listado
         cmd = ["-s", device_id, "shell", "ls", "-l", path]
-        output = run_adb_command(cmd, check_exit_code=False)
+        output, magic_map = await asyncio.gather(
+            run_adb_async(cmd, check_exit_code=False),
+            _fetch_magic(device_id, path),
+            return_exceptions=True
+        )
+        if isinstance(output, BaseException): raise output
+        if isinstance(magic_map, BaseException): magic_map = {}
         
         if "Permission denied" in output:
             return {"path": path, "error": "Permission Denied (Try run-as or root)", "files": []}
@@ -310,29 +535,9 @@ def list_files_in_path(device_id: str, path: str):
              
         files = parse_ls_output(output)
 
-        try:
-            safe_path = path.replace('"', '\\"')
-            cmd_magic = ["-s", device_id, "shell", f"cd \"{safe_path}\" && file *"]
-            magic_output = run_adb_command(cmd_magic, check_exit_code=False)
-            
-            magic_map = {}
-            for line in magic_output.split('\n'):
-                line = line.strip()
-                if ": " in line:
-                    parts = line.split(": ", 1)
-                    if len(parts) == 2:
-                        fname = parts[0].strip()
-                        if fname.startswith("./"): fname = fname[2:]
-                        fname = fname.strip("'").strip('"')
-                        desc = parts[1].strip()
-                        magic_map[fname] = desc
-            
-            for f in files:
-                if f['type'] == 'file':
-                    f['magic'] = magic_map.get(f['name'], None)
-
-        except Exception:
-            pass
+        for f in files:
+            if f['type'] == 'file':
+                f['magic'] = magic_map.get(f['name'], None)
 
         files.sort(key=lambda x: (x['type'] != 'dir', x['name']))
         return {"path": path, "files": files}
@@ -340,46 +545,69 @@ def list_files_in_path(device_id: str, path: str):
          return {"path": path, "error": str(e), "files": []}
 
 @app.get("/files/{device_id}/read")
-def read_file_content(device_id: str, path: str):
+async def read_file_content(device_id: str, path: str, include: str = "size,strings"):
+    # El cliente elige qué vistas necesita: content, strings, base64, size
+    parts = {p.strip() for p in include.split(",") if p.strip()}
     try:
-        cmd = ["-s", device_id, "shell", "cat", path]
-        raw_bytes = run_adb_command(cmd, binary_mode=True)
-        decoded_content = raw_bytes.decode('utf-8', errors='replace')
-        strings = extract_strings_from_bytes(raw_bytes)
-        b64_content = base64.b64encode(raw_bytes).decode('utf-8')
-
-        return {
-            "path": path,
-            "size": len(raw_bytes),
-            "content": decoded_content,
-            "strings": strings,
-            "base64": b64_content 
-        }
+        # exec-out: bytes crudos sin PTY (sin traducción \n <-> \r\n), válido también para la transmisión.
+        # No informa del código de salida, por eso la legibilidad se sondea antes en ambos caminos.
+        cmd = ["-s", device_id, "exec-out", "cat", path]
+        file_size = await probe_readable_size(device_id, path)
+
+        # Solo Base64 de un archivo grande: se transmite sin cargarlo entero en memoria
+        if "base64" in parts and not parts & {"content", "strings"}:
+            if file_size is not None and file_size > _STREAM_THRESHOLD:
+                stream = await stream_adb_base64(cmd, file_size)
+                return StreamingResponse(stream, media_type="text/plain", headers={"X-File-Size": str(file_size)})
+
+        raw_bytes = await run_adb_async(cmd, binary_mode=True)
+        result = {"path": path}
+        if "size" in parts: result["size"] = len(raw_bytes)
+        if "content" in parts: result["content"] = raw_bytes.decode('utf-8', errors='replace')
+        if "strings" in parts: result["strings"] = extract_strings_from_bytes(raw_bytes)
+        if "base64" in parts: result["base64"] = base64.b64encode(raw_bytes).decode('utf-8')
+        return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/logs/{device_id}")
-def get_logs(device_id: str, query: str):
+async def get_logs(device_id: str, query: str):
     try:
-        cmd = ["-s", device_id, "shell", f"logcat -d | grep {query}"]
-        logs = run_adb_command(cmd, check_exit_code=False)
+        cmd = ["-s", device_id, "logcat", "-d"]
+        logs = "\n".join(await grep_adb_lines(cmd, re.compile(re.escape(query)))).strip()
         if not logs: return {"query": query, "logs": "--- Silencio: No se encontraron registros recientes ---"}
         return {"query": query, "logs": logs}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.delete("/cache/{device_id}")
+async def invalidate_cache(device_id: str):
+    return {"device_id": device_id, "cleared": clear_device_cache(device_id)}
+
+def _index_html_path() -> str:
+    try: current_dir = os.path.dirname(os.path.abspath(__file__))
+    except NameError: current_dir = os.getcwd()
+    file_path = os.path.join(current_dir, "index.html")
+    if not os.path.exists(file_path): file_path = "index.html"
+    return file_path
+
+# El Canvas se carga una sola vez al importar; cada visita a "/" se sirve desde memoria
+try:
+    with open(_index_html_path(), "rb") as f: _INDEX_HTML_BYTES = f.read()
+except OSError:
+    _INDEX_HTML_BYTES = None
+
 @app.get("/", response_class=HTMLResponse)
-def read_root():
+async def read_root():
     try:
-        try: current_dir = os.path.dirname(os.path.abspath(__file__))
-        except NameError: current_dir = os.getcwd()
-        file_path = os.path.join(current_dir, "index.html")
-        if not os.path.exists(file_path): file_path = "index.html"
-        if os.path.exists(file_path):
-            with open(file_path, "r", encoding="utf-8") as f: return f.read()
+        if _INDEX_HTML_BYTES is not None:
+            return HTMLResponse(content=_INDEX_HTML_BYTES, headers={"Cache-Control": "public, max-age=60"})
+        file_path = _index_html_path()
+        if os.path.exists(file_path): return FileResponse(file_path, media_type="text/html")
         else: return HTMLResponse(content="<h1>Error: index.html no encontrado</h1>", status_code=404)
     except Exception as e: return HTMLResponse(content=f"<h1>Error interno</h1><p>{str(e)}</p>", status_code=500)
 
 if __name__ == "__main__":
-    print(f"Iniciando servidor consciente. Usando ADB en: {ADB_PATH}")
-    uvicorn.run(app, host="127.0.0.1", port=8000)
\ No newline at end of file
+    print(f"Iniciando servidor consciente en http://127.0.0.1:8000. Usando ADB en: {ADB_PATH}")
+    # "auto" elige uvloop y httptools (uvicorn[standard]) cuando están instalados; en Windows recae en asyncio/h11
+    uvicorn.run(app, host="127.0.0.1", port=8000, loop="auto", http="auto", log_level="warning")
\ No newline at end of file